@@ -0,0 +1,78 @@
+"""
+Benchmark of the import time of the mfs package.
+
+Each statement is run in a fresh interpreter with a minimal Django
+configuration, the median time of some runs is printed with the
+heavy modules that are imported by the statement.
+
+Usage:
+    python benchmarks/import_time.py [runs]
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ['jwt', 'rest_framework']
+
+SETUP = """
+import django
+from django.conf import settings
+settings.configure(
+    BASE_DIR={tmpdir!r},
+    SECRET_KEY="benchmark",
+    INSTALLED_APPS=["django.contrib.contenttypes",
+                    "django.contrib.auth", "mfs"],
+    DATABASES={{"default": {{"ENGINE": "django.db.backends.sqlite3",
+                            "NAME": ":memory:"}}}},
+)
+"""
+
+STATEMENTS = [
+    ("import mfs", "", "import mfs"),
+    ("django.setup()", "", "django.setup()"),
+    ("import mfs.models", "django.setup()", "import mfs.models"),
+    ("import mfs.core", "django.setup()", "import mfs.core"),
+    ("import mfs.middlew", "django.setup()", "import mfs.middlew"),
+]
+
+PROGRAM = """
+import sys, time, json
+sys.path.insert(0, {root!r})
+{setup}
+{before}
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [m for m in {heavy!r} if m in sys.modules]]))
+"""
+
+
+def measure(statement, before, tmpdir):
+    """ Function to run a statement in a fresh interpreter. """
+    program = PROGRAM.format(root=ROOT, setup=SETUP.format(tmpdir=tmpdir),
+                             before=before, statement=statement, heavy=HEAVY)
+    out = subprocess.run([sys.executable, '-c', program], check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(runs=5):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, before, statement in STATEMENTS:
+            times = []
+            heavy = []
+            for _ in range(runs):
+                elapsed, heavy = measure(statement, before, tmpdir)
+                times.append(elapsed)
+            print("{:<20} {:>8.2f} ms   {}".format(
+                name, statistics.median(times) * 1000,
+                ', '.join(heavy) or '-'))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -1,23 +1,12 @@
-import os
-from django.conf import settings
 from .utils import *
-# from .core  import *
 
 
-FSDIR = None
-FSURL = None
-
-if not hasattr(settings, 'FSDIR'):
-    FSDIR = os.path.join(settings.BASE_DIR, "fsdir")
-else:
-    FSDIR = settings.FSDIR
-
-if not os.path.isdir(FSDIR):
-    os.mkdir(FSDIR)
-    printsucc("{} is created.".format(FSDIR))
-
-if not hasattr(settings, 'FSURL'):
-    FSURL = "/file/"
-else:
-    FSURL = settings.FSURL
-
+def __getattr__(name):
+    """
+    Function to get the FSDIR and FSURL settings, they are
+    resolved on their first use (see `mfs.conf.mfs_settings`).
+    """
+    if name in ('FSDIR', 'FSURL'):
+        from .conf import mfs_settings
+        return getattr(mfs_settings, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
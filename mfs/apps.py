@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class MfsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mfs'
+
+    def ready(self):
+        """
+        Function to check the root directory of the files
+        and to connect the signals of the file models.
+        """
+        from django.core.signals import setting_changed
+        from .conf import mfs_settings
+        from .conf import ensure_fsdir
+        from .cache import connect_signals
+        setting_changed.connect(mfs_settings.reload,
+                                dispatch_uid="mfs.conf.reload")
+        ensure_fsdir()
+        connect_signals()
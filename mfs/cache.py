@@ -0,0 +1,291 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.db.models.signals import post_delete
+from .conf import mfs_settings
+from .models import File
+
+
+class LRUCache:
+    """
+    In-process LRU cache of a limited size whose entries
+    expire after a time to live. By default, the size and the
+    time to live are the MFS_RESOLVE_CACHE_SIZE and
+    MFS_RESOLVE_CACHE_TTL settings.
+    """
+
+    def __init__(self, maxsize=None, ttl=None):
+        """ Constructor of the LRU cache """
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def maxsize(self):
+        return self._maxsize or mfs_settings.MFS_RESOLVE_CACHE_SIZE
+
+    @property
+    def ttl(self):
+        return self._ttl or mfs_settings.MFS_RESOLVE_CACHE_TTL
+
+    def get(self, key):
+        """ Function to get the value of a key, or None. """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """ Function to set the value of a key. """
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """ Function to remove a key. """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """ Function to remove all the keys. """
+        with self._lock:
+            self._data.clear()
+
+
+local = LRUCache()
+
+
+def backend():
+    """ Function to get the shared Django cache, or None.
+
+    The shared cache is the one of alias settings.MFS_RESOLVE_CACHE,
+    it is disabled if this setting is not defined.
+    """
+    alias = mfs_settings.MFS_RESOLVE_CACHE
+    if not alias:
+        return None
+    from django.core.cache import caches
+    return caches[alias]
+
+
+def cache_key(model, pk):
+    """ Function to build the cache key of a file.
+
+    Args:
+        model (:obj:`type`): The file model class.
+        pk: The primary key of the file.
+
+    Returns:
+        str: The cache key.
+    """
+    return f"mfs:{model._meta.label_lower}:{pk}"
+
+
+def describe(file: File):
+    """ Function to get the cached information of a file.
+
+    Args:
+        file (:obj:`File`): The file object.
+
+    Returns:
+        dict: The file path, the URL relative to the host,
+            the visibility and the size of the file.
+    """
+    return {
+        "filepath": file.filepath,
+        "url": file.url(),
+        "visibility": file.visibility,
+        "size": file.size,
+    }
+
+
+def version_key(key):
+    """ Function to build the key of the version of a cached file. """
+    return f"{key}:v"
+
+
+def resolve(model, pk):
+    """ Function to resolve a file id into its information.
+
+    The in-process LRU cache is checked first, then the shared
+    cache, and the database is hit only if both miss.
+
+    With a shared cache, each entry is tagged with the version of
+    the file stored in the shared cache. This version is read on
+    each local hit, so an invalidation done by any worker is seen
+    at once by all the workers. Without a shared cache, the other
+    processes see the changes after MFS_RESOLVE_CACHE_TTL seconds.
+
+    Args:
+        model (:obj:`type`): The file model class.
+        pk: The primary key of the file.
+
+    Returns:
+        dict: The information of the file (see `describe`).
+
+    Raises:
+        Http404: If the file is not exists in the database.
+    """
+    key = cache_key(model, pk)
+    shared = backend()
+    version = None
+    if shared is not None:
+        # the version is read before the file, so an entry
+        # built from a row older than this version is never
+        # accepted later.
+        version = shared.get(version_key(key))
+
+    entry = local.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    info = None
+    if shared is not None:
+        entry = shared.get(key)
+        if entry is not None and entry[0] == version:
+            info = entry[1]
+
+    if info is None:
+        try:
+            info = describe(model._default_manager.get(pk=pk))
+        except (model.DoesNotExist, ValueError):
+            from django.http import Http404
+            raise Http404(f"No {model._meta.object_name} matches the id.")
+        if shared is not None:
+            shared.set(key, (version, info), local.ttl)
+
+    local.set(key, (version, info))
+    return info
+
+
+def invalidate(model, *pks):
+    """ Function to remove some files from the caches.
+
+    The versions of the files in the shared cache are changed,
+    so the entries kept by the other workers are not used anymore.
+
+    Args:
+        model (:obj:`type`): The file model class.
+        pks: The primary keys of the files.
+    """
+    keys = [cache_key(model, pk) for pk in pks]
+    for key in keys:
+        local.delete(key)
+    shared = backend()
+    if shared is not None:
+        version = uuid.uuid4().hex
+        shared.set_many({version_key(key): version for key in keys},
+                        10 * local.ttl)
+        shared.delete_many(keys)
+
+
+def _path_lookup(path):
+    """ Function to find the file model and the id of a URL path. """
+    from django.db.models import Q
+    filedir, name = os.path.split(path)
+    for model in apps.get_models():
+        if not issubclass(model, File):
+            continue
+        where = Q(filedir=filedir)
+        if filedir == (model.DEFAULT_DIR_NAME or ''):
+            # the URL of a file without filedir
+            where |= Q(filedir__isnull=True) | Q(filedir='')
+        pk = model._base_manager.filter(where, name=name)\
+            .values_list('pk', flat=True).first()
+        if pk is not None:
+            return model, pk
+    return None
+
+
+def lookup(path, refresh=False):
+    """ Function to find the file of a URL path.
+
+    The path is mapped to the id of the file in the in-process
+    LRU cache, then the file is resolved by `resolve`. The mapping
+    is checked against the URL of the resolved file, so it is
+    never wrong after a move or a deletion of the file.
+
+    Args:
+        path (str): The path of the file URL, relative to the FSURL.
+        refresh (bool): Resolve the file again from the database.
+
+    Returns:
+        tuple: The file model class, the primary key of the file
+            and its information (see `describe`).
+
+    Raises:
+        Http404: If no file has this URL.
+    """
+    from django.http import Http404
+    key = f"mfs:path:{path}"
+    url = mfs_settings.FSURL + path
+    found = None if refresh else local.get(key)
+    for _ in range(2):
+        if found is None:
+            found = _path_lookup(path)
+            if found is None:
+                raise Http404("No file matches the path.")
+            local.set(key, found)
+        if refresh:
+            invalidate(*found)
+        try:
+            info = resolve(*found)
+            if info["url"] == url:
+                return found[0], found[1], info
+        except Http404:
+            pass
+        local.delete(key)
+        found = None
+    raise Http404("No file matches the path.")
+
+
+def resolve_path(path, refresh=False):
+    """ Function to resolve a URL path into the information of a file.
+
+    Args:
+        path (str): The path of the file URL, relative to the FSURL.
+        refresh (bool): Resolve the file again from the database.
+
+    Returns:
+        dict: The information of the file (see `describe`).
+
+    Raises:
+        Http404: If no file has this URL.
+    """
+    return lookup(path, refresh)[2]
+
+
+def _on_change(sender, instance, **kwargs):
+    """
+    Receiver of the post_save and post_delete signals, the files
+    are invalidated when the transaction is committed, so a
+    concurrent `resolve` cannot cache the old row again.
+    """
+    pk = instance.pk
+    transaction.on_commit(lambda: invalidate(sender, pk))
+
+
+def connect_signals():
+    """
+    Function to connect the cache invalidation to the signals
+    of all the installed file models.
+    """
+    for model in apps.get_models():
+        if issubclass(model, File):
+            uid = f"mfs.cache:{model._meta.label_lower}"
+            post_save.connect(_on_change, sender=model, dispatch_uid=uid)
+            post_delete.connect(_on_change, sender=model, dispatch_uid=uid)
@@ -0,0 +1,77 @@
+import os
+
+
+class MfsSettings:
+    """
+    Lazy settings of the MFS. Each setting is read from the Django
+    settings on its first use, then it is kept. The settings are
+    reloaded when they are overridden (e.g. by override_settings
+    in the tests).
+    """
+    DEFAULTS = {
+        'FSURL': "/file/",
+        'MFS_RESOLVE_CACHE': None,
+        'MFS_RESOLVE_CACHE_SIZE': 4096,
+        'MFS_RESOLVE_CACHE_TTL': 60,
+        'MFS_UPLOAD_TASKS': ['hash', 'mime'],
+        'MFS_JOB_LEASE': 600,
+        'MFS_DOWNLOAD_RATE': None,
+        'MFS_DOWNLOAD_TOTAL_RATE': None,
+        'MFS_DOWNLOAD_MAX_STREAMS': None,
+        'MFS_DOWNLOAD_WAIT': 0.5,
+        'MFS_DOWNLOAD_PROCESSES': 1,
+        'FSDIRS': {},
+        'MFS_DEFAULT_TIER': None,
+        'MFS_TIER_POLICY': None,
+        'MFS_TIER_FLUSH': 10,
+        'MFS_TIER_PROMOTE_HITS': 10,
+        'MFS_TIER_DEMOTE_HITS': 1,
+        'MFS_ACCESS_TOKEN_MAX_AGE': 24 * 3600,
+        'MFS_REVOCATION_SYNC': 5,
+    }
+
+    def __getattr__(self, name):
+        """ Function to resolve a setting on its first use. """
+        from django.conf import settings
+        if name == 'FSDIR':
+            value = getattr(settings, 'FSDIR', None)\
+                or os.path.join(settings.BASE_DIR, "fsdir")
+        elif name in self.DEFAULTS:
+            value = getattr(settings, name, self.DEFAULTS[name])
+        else:
+            raise AttributeError(f"{name} is not a MFS setting.")
+        self.__dict__[name] = value
+        return value
+
+    def reload(self, *args, **kwargs):
+        """ Function to forget the resolved settings. """
+        self.__dict__.clear()
+
+
+mfs_settings = MfsSettings()
+
+
+def tier_root(tier):
+    """ Function to get the root directory of a storage tier.
+
+    Args:
+        tier (str): The name of the tier in settings.FSDIRS.
+
+    Returns:
+        str: The root directory of the tier, or the FSDIR
+            if the tier is not defined.
+    """
+    if tier:
+        root = mfs_settings.FSDIRS.get(tier)
+        if root:
+            return root
+    return mfs_settings.FSDIR
+
+
+def ensure_fsdir():
+    """ Function to create the root directories of the files. """
+    for root in [mfs_settings.FSDIR, *mfs_settings.FSDIRS.values()]:
+        if not os.path.isdir(root):
+            os.makedirs(root)
+            from .utils import printsucc
+            printsucc("{} is created.".format(root))
@@ -1,9 +1,9 @@
 import os
-import jwt
+import uuid
 import datetime as dt
-from django.contrib.auth.models import User
 from django.conf import settings
-from .       import FSDIR
+from .conf   import mfs_settings
+from .conf   import tier_root
 from .models import File
 from .utils  import *
 
@@ -79,7 +79,8 @@ def get_access_url(request, file: File, duration=dt.timedelta(minutes=1)):
             via the view.
         file (:obj:`File`): The file object.
         duration (:obj:`timedelta`): The duration of the token.
-            Default set to 1 min (dt.timedelta(minutes=1)).
+            Default set to 1 min (dt.timedelta(minutes=1)), it is
+            limited to settings.MFS_ACCESS_TOKEN_MAX_AGE.
 
     Returns:
         tuple: Returns the tuple of access URL and the string
@@ -87,27 +88,36 @@ def get_access_url(request, file: File, duration=dt.timedelta(minutes=1)):
         bool: Returns False, if the access to this file is not
             allowed to this request.user.
     """
+    import jwt
+    from .revocation import file_key
     user = request.user
     url = None
     tok = None
     if hasperm(file, user):
         ipc = get_client_ip(request)
         url = file.url(request.build_absolute_uri('/'))
+        now = dt.datetime.utcnow()
+        max_age = dt.timedelta(seconds=mfs_settings.MFS_ACCESS_TOKEN_MAX_AGE)
         tok = jwt.encode({
+                'jti':  uuid.uuid4().hex,
                 'user': userinfo(user),
                 'ipc':  ipc,
-                'exp':  dt.datetime.utcnow() + duration
+                'file': file_key(file),
+                'iat':  now,
+                'exp':  now + min(duration, max_age)
         }, settings.SECRET_KEY, algorithm='HS256')
         return url, tok
     else:
         return False
 
 
-def getfile(filename, fclass, dirname=FSDIR):
+def getfile(filename, fclass, dirname=None, tier=''):
     """
     Function to retrieve a file from the server's file system.
-    file system.
+    file system. By default, the file is searched in the root
+    directory of the storage tier.
     """
+    dirname = dirname or tier_root(tier)
     # if we check if the class indicated
     # to contain the information about the file
     # that we want to index is indeed a subclass
@@ -117,24 +127,32 @@ def getfile(filename, fclass, dirname=FSDIR):
         # and that the file exists in the location 
         # indicated in this path
         abspath = os.path.join(dirname, filename)
-        if os.path.exists(abspath):
+        try:
+            st = os.stat(abspath)
+        except OSError:
+            st = None
+        if st is not None:
             # we then instantiate a new object of type fclass
             # to contain the information about the latter
-            instance = fclass()
+            instance = fclass(tier=tier)
             dirn = os.path.dirname(filename)
             instance.filedir = dirn if dirn else dirname
             filenamext = (os.path.basename(filename)).split('.')
             instance.name = filenamext[0]
             instance.ext = filenamext[1] if len(filenamext) > 1 else ''
-            instance.size = os.path.getsize(abspath)
+            instance.size = st.st_size
+            instance.mtime = st.st_mtime
+            instance.inode = st.st_ino
             return instance
 
 
-def find(filename, fclass, dirname=FSDIR):
+def find(filename, fclass, dirname=None, tier=''):
     """
     Search function for a file in the server's file system.
-    of the server.
+    of the server. By default, the file is searched in the root
+    directory of the storage tier.
     """
+    dirname = dirname or tier_root(tier)
     # if we check if the class indicated
     # to contain the information about the file
     # that we want to index is indeed a subclass
@@ -157,7 +175,7 @@ def find(filename, fclass, dirname=FSDIR):
                         # the file you are looking for is found, 
                         # then you create the instance 
                         # of the specified class
-                        return getfile(f, fclass, dirname)
+                        return getfile(f, fclass, dirname, tier)
                     elif os.path.isfile(absf):
                         # if it is a file, then
                         # we continue the search.
@@ -165,7 +183,7 @@ def find(filename, fclass, dirname=FSDIR):
                     else:
                         # in this case, it is a folder
                         # so we call again the function
-                        result = find(filename, fclass, absf)
+                        result = find(filename, fclass, absf, tier)
                         if not result:
                             # if there are no results, then
                             # we continue the search
@@ -180,19 +198,25 @@ def find(filename, fclass, dirname=FSDIR):
 def get_file_uploaded(file_uploaded, FileModel, filedir=''):
     """
     Function to retrieve an uploaded file.
+
+    The post processing tasks (settings.MFS_UPLOAD_TASKS) are
+    queued when the returned instance is saved, they are run
+    in background by the mfs_worker command.
     """
     # info(request.FILES);
     if file_uploaded:
         instance = FileModel(name=str(file_uploaded), filedir=filedir).touch()
         moved = handle_uploaded_file(file_uploaded, instance.filepath)
         if moved:
-            info(file_uploaded)
-            info(file_uploaded.content_type)
+            printinfo(file_uploaded)
+            printinfo(file_uploaded.content_type)
+            # provisional extension, replaced by
+            # the one sniffed by the mime task.
             ctsplited = file_uploaded.content_type.split('/')
             if len(ctsplited) >= 2:
                 instance.ext = ctsplited[1]
+            instance._pending_tasks = list(mfs_settings.MFS_UPLOAD_TASKS)
             return instance
         else:
-            erro("Moving of file uploaded is failed.")
+            printerr("Moving of file uploaded is failed.")
     return 0
-
@@ -0,0 +1,42 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from mfs import utils
+from mfs import tiering
+from mfs.models import File
+
+
+class Command(BaseCommand):
+    help = "Promote the hot files and demote the cold files between the storage tiers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*',
+                            help="File models (app_label.Model), "
+                                 "all the file models by default.")
+        parser.add_argument('--promote-hits', type=int, default=None,
+                            help="Min access count to promote a file.")
+        parser.add_argument('--demote-hits', type=int, default=None,
+                            help="Access count under which a file is demoted.")
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Max number of files moved in each "
+                                 "direction by model.")
+
+    def handle(self, *args, **options):
+        """ Function of rebalancing of the storage tiers. """
+        if len(tiering.tiers()) < 2:
+            utils.printwarn("At least two storage tiers (FSDIRS) are needed.")
+            return
+
+        if options['models']:
+            models = [apps.get_model(label) for label in options['models']]
+        else:
+            models = [m for m in apps.get_models() if issubclass(m, File)]
+
+        for model in models:
+            promoted, demoted = tiering.rebalance(
+                model,
+                promote_hits=options['promote_hits'],
+                demote_hits=options['demote_hits'],
+                limit=options['limit'],
+            )
+            utils.printsucc(f"{model._meta.label}: {promoted} files promoted, "
+                            f"{demoted} files demoted.")
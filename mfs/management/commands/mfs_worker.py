@@ -0,0 +1,160 @@
+import os
+import sys
+import time
+import signal
+import datetime as dt
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Q
+from django.utils import timezone
+from mfs import utils
+from mfs import tasks
+from mfs.conf import mfs_settings
+from mfs.models import Job
+
+
+class Command(BaseCommand):
+    help = "Run the queued processing tasks of the files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help="Number of worker processes.")
+        parser.add_argument('--max-inflight', type=int, default=None,
+                            help="Max number of jobs claimed at once "
+                                 "(default: 2 x processes).")
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help="Polling interval in seconds.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit when the queue is empty.")
+        parser.add_argument('--lease', type=float, default=None,
+                            help="Seconds after which a running job of a "
+                                 "dead worker is claimed again "
+                                 "(default: MFS_JOB_LEASE).")
+
+    def claim(self, limit, lease):
+        """ Function to claim some pending jobs of the queue.
+
+        The running jobs claimed more than lease seconds ago are
+        claimed again, their worker is considered dead. The ones
+        that have used all their attempts are marked as failed.
+
+        Args:
+            limit (int): The max number of jobs to claim.
+            lease (float): The lease of the claimed jobs in seconds.
+
+        Returns:
+            list: The list of the claimed jobs.
+        """
+        now = timezone.now()
+        expired = now - dt.timedelta(seconds=lease)
+        with transaction.atomic():
+            Job.objects.filter(status=Job.RUNNING, claimed_at__lt=expired,
+                               attempts__gte=F('max_attempts'))\
+                .update(status=Job.FAILED, updated_at=now,
+                        error="The lease is expired.")
+            jobs = list(
+                Job.objects.select_for_update(skip_locked=True)
+                .filter(Q(status=Job.PENDING, run_after__lte=now)
+                        | Q(status=Job.RUNNING, claimed_at__lt=expired,
+                            attempts__lt=F('max_attempts')))
+                .order_by('run_after')[:limit]
+            )
+            if jobs:
+                Job.objects.filter(pk__in=[job.pk for job in jobs])\
+                    .update(status=Job.RUNNING, claimed_at=now,
+                            attempts=F('attempts') + 1)
+        for job in jobs:
+            job.attempts += 1
+        return jobs
+
+    def finish(self, job, future):
+        """ Function to save the result of a job, or retry it. """
+        try:
+            result = future.result()
+            tasks.apply_result(job, result)
+            job.result = result
+            job.status = Job.DONE
+            job.error = ''
+        except Exception as e:
+            job.error = repr(e)
+            if job.attempts < job.max_attempts:
+                # exponential backoff before the next attempt
+                job.status = Job.PENDING
+                job.run_after = timezone.now()\
+                    + dt.timedelta(seconds=2 ** job.attempts)
+                utils.printwarn(f"{job} failed, it will be retried: {e}")
+            else:
+                job.status = Job.FAILED
+                utils.printerr(f"{job} failed: {e}")
+        job.save(update_fields=['result', 'status', 'error',
+                                'run_after', 'updated_at'])
+
+    def abort(self, job, error):
+        """ Function to mark a job as failed without retry. """
+        job.status = Job.FAILED
+        job.error = error
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        utils.printerr(f"{job} failed: {error}")
+
+    def requeue(self, jobs):
+        """ Function to give back the unfinished jobs to the queue. """
+        if jobs:
+            Job.objects.filter(pk__in=[job.pk for job in jobs],
+                               status=Job.RUNNING)\
+                .update(status=Job.PENDING, claimed_at=None,
+                        attempts=F('attempts') - 1)
+            utils.printwarn(f"{len(jobs)} jobs are given back to the queue.")
+
+    def handle(self, *args, **options):
+        """ Function of running of the worker. """
+        processes = max(1, options['processes'] or 1)
+        max_inflight = options['max_inflight'] or 2 * processes
+        utils.printinfo(f"MFS worker with {processes} processes ...")
+
+        # the database connections must not be shared
+        # with the forked processes.
+        connections.close_all()
+        lease = options['lease'] or mfs_settings.MFS_JOB_LEASE
+        inflight = {}
+        pool = ProcessPoolExecutor(max_workers=processes)
+        # a SIGTERM stops the worker like a Ctrl-C
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        try:
+            while True:
+                # backpressure: no more jobs are claimed
+                # while max_inflight jobs are running.
+                claimed = []
+                if len(inflight) < max_inflight:
+                    claimed = self.claim(max_inflight - len(inflight), lease)
+                    filepaths = tasks.resolve_filepaths(claimed)
+                    for job in claimed:
+                        if filepaths[job.pk] is None:
+                            self.abort(job, "The file is deleted.")
+                            continue
+                        future = pool.submit(tasks.run, job.task,
+                                             filepaths[job.pk])
+                        inflight[future] = job
+
+                if not inflight:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+
+                done, _ = wait(inflight, timeout=options['poll'],
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.finish(inflight.pop(future), future)
+        except KeyboardInterrupt:
+            utils.printwarn("MFS worker is interrupted.")
+        finally:
+            for future in inflight:
+                future.cancel()
+            self.requeue(list(inflight.values()))
+            pool.shutdown(wait=False)
+        utils.printsucc("MFS worker is stopped.")
@@ -1,10 +1,10 @@
 import re
-import jwt
+from urllib.parse import urlsplit
 from django.conf import settings
-from rest_framework.response import Response
-from rest_framework.renderers import JSONRenderer
 from .utils import *
-from . import FSURL
+from .conf import mfs_settings
+from .scheduler import scheduler
+from .scheduler import client_key
 
 
 class FileAccessMiddleware:
@@ -21,7 +21,7 @@ class FileAccessMiddleware:
         #     },
         #    settings.SECRET_KEY, algorithm='HS256')
         absuri  = request.build_absolute_uri()
-        mfsuri  = request.build_absolute_uri(FSURL)
+        mfsuri  = request.build_absolute_uri(mfs_settings.FSURL)
         is_furl = re.match(f"^{mfsuri}", absuri)
 
         if not is_furl:
@@ -30,9 +30,10 @@ class FileAccessMiddleware:
             return self.get_response(request)
         else:
             printinfo(absuri)
-            return self.__file_rec(request)
+            path = request.path[len(urlsplit(mfsuri).path):]
+            return self.__file_rec(request, path)
 
-    def __file_rec(self, request):
+    def __file_rec(self, request, path):
         message = ''
         token = ''
         code = 200
@@ -48,15 +49,57 @@ class FileAccessMiddleware:
 
         try:
             if token:
+                import jwt
+                from django.http import Http404
+                from .cache import lookup
+                from .revocation import revocations
+                from .revocation import file_key
                 data = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-                return self.get_response(request)
+                try:
+                    model, pk, _ = lookup(path)
+                except Http404:
+                    return self.__error("File not found !", 404)
+
+                # the token gives access only to its own file
+                key = file_key(model, pk)
+                if data.get('file') != key:
+                    return self.__error("Access denied !", 403)
+                if revocations.is_revoked(dict(data, file=key)):
+                    return self.__error("Access revoked !", 403)
+                return self.__schedule(request, data)
         except:
             message = "Access denied !"
             code = 403
 
         # Code to be executed for each request/response after
         # the view is called.
+        return self.__error(message, code)
+
+    def __schedule(self, request, data):
+        """
+        Function to run the download in a stream slot of the client,
+        the chunks of the streamed files are paced by the scheduler.
+        """
+        key = client_key(data, request)
+        if not scheduler.acquire(key):
+            return self.__error("Too many downloads !", 429)
+        try:
+            response = self.get_response(request)
+        except:
+            scheduler.release(key)
+            raise
+
+        if response.streaming:
+            response.streaming_content = scheduler.pace(
+                key, response.streaming_content)
+        else:
+            scheduler.release(key)
+        return response
 
+    def __error(self, message, code):
+        """ Function to build a JSON error response. """
+        from rest_framework.response import Response
+        from rest_framework.renderers import JSONRenderer
         resp = Response({"message": message}, status=code)
         resp.accepted_media_type = "application/json"
         resp.accepted_renderer = JSONRenderer()
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-19 20:26
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Revocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('token', 'Token'), ('user', 'User'), ('file', 'File')], max_length=8, verbose_name='Kind')),
+                ('value', models.CharField(max_length=255, verbose_name='Value')),
+                ('revoked_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Revocation date')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Expiration date')),
+            ],
+            options={
+                'ordering': ['revoked_at'],
+            },
+        ),
+    ]
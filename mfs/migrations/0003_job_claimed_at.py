@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfs', '0002_revocation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Claim date'),
+        ),
+    ]
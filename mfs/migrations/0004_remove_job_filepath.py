@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-19 20:34
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfs', '0003_job_claimed_at'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='job',
+            name='filepath',
+        ),
+    ]
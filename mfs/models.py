@@ -1,11 +1,227 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from django.utils.translation import gettext as _
 from django.db import models
-from . import FSDIR
-from . import FSURL
+from django.db import transaction
+from django.utils import timezone
+from .conf import mfs_settings
+from .conf import tier_root
 from .utils import *
 
 
+# directories known to exist, they are not checked again
+_known_dirs = set()
+
+
+def _unlink(filepath):
+    """ Function to remove a file, a missing file is not an error.
+
+    Args:
+        filepath (str): The absolute path to the file.
+
+    Returns:
+        str: The error message, or None if the file is removed.
+    """
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        return str(e)
+
+
+def _rename(paths):
+    """ Function to move a file without overwriting the destination.
+
+    The file is linked at the destination, which fails if the
+    destination exists, then it is unlinked from the source.
+
+    Args:
+        paths (tuple): The source and the destination paths.
+
+    Returns:
+        str: The error message, or None if the file is moved.
+    """
+    src, dst = paths
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        return "{} is already exists.".format(dst)
+    except OSError as e:
+        return str(e)
+    try:
+        os.unlink(src)
+    except OSError as e:
+        try:
+            os.unlink(dst)
+        except OSError as err:
+            return "{} (the link {} is not removed: {})".format(e, dst, err)
+        return str(e)
+
+
+class FileQuerySet(models.QuerySet):
+    """
+    Query set of the file models with the bulk operations
+    on the server's file system.
+    """
+    BULK_BATCH_SIZE = 1000
+    BULK_MAX_WORKERS = 16
+
+    def _batches(self, batch_size):
+        """ Function to iterate over this query set by batches. """
+        batch = []
+        for instance in self.iterator(chunk_size=batch_size):
+            batch.append(instance)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _run(self, func, items, batch_size, max_workers):
+        """ Function to apply func concurrently on items by batches.
+
+        Args:
+            func (callable): The function applied on each item, it
+                returns an error message or None on success.
+            items (callable): The function that returns the list
+                of the arguments of func from a batch of instances.
+            batch_size (int): The number of instances by batch.
+            max_workers (int): The number of threads of the pool.
+
+        Returns:
+            tuple: The list of the primary keys of the instances
+                processed successfully and the dictionary of the
+                failures (primary key -> error message).
+        """
+        done = []
+        failed = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for batch in self._batches(batch_size):
+                errors = pool.map(func, items(batch))
+                for instance, error in zip(batch, errors):
+                    if error is None:
+                        done.append(instance.pk)
+                    else:
+                        failed[instance.pk] = error
+        return done, failed
+
+    def bulk_delete(self, batch_size=None, max_workers=None):
+        """ Function to delete the files of this query set.
+
+        The rows of the files are deleted from the database in only
+        one transaction, then the files are removed concurrently from
+        the file system when this transaction is committed. So a
+        failure leaves orphaned files, but never rows without files.
+
+        The rows are deleted without sending the delete signals and
+        without cascading on the related rows, the files are removed
+        from the resolve cache at once on commit.
+
+        Args:
+            batch_size (int): The number of files by batch.
+                Default set to BULK_BATCH_SIZE.
+            max_workers (int): The number of threads used to remove
+                the files. Default set to BULK_MAX_WORKERS.
+
+        Returns:
+            tuple: The list of the primary keys of the deleted rows
+                and the dictionary of the files not removed
+                (primary key -> error message). If this function is
+                called in a transaction, this dictionary is filled
+                when the transaction is committed.
+        """
+        from .cache import invalidate
+        batch_size = batch_size or self.BULK_BATCH_SIZE
+        max_workers = max_workers or self.BULK_MAX_WORKERS
+        filepaths = {}
+        for batch in self._batches(batch_size):
+            for instance in batch:
+                filepaths[instance.pk] = instance.filepath
+        done = list(filepaths)
+        failed = {}
+
+        def unlink():
+            invalidate(self.model, *done)
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                errors = pool.map(_unlink, filepaths.values())
+                for pk, error in zip(done, errors):
+                    if error is not None:
+                        failed[pk] = error
+            printsucc("{} files are deleted.".format(len(done) - len(failed)))
+            if failed:
+                printerr("{} files are not deleted.".format(len(failed)))
+
+        with transaction.atomic(using=self.db):
+            for i in range(0, len(done), batch_size):
+                self.model._base_manager.using(self.db)\
+                    .filter(pk__in=done[i:i + batch_size])\
+                    ._raw_delete(self.db)
+            transaction.on_commit(unlink, using=self.db)
+        return done, failed
+
+    def bulk_move(self, to_filedir, batch_size=None, max_workers=None):
+        """ Function to move the files of this query set.
+
+        The files are moved concurrently into the new parent
+        directory, then the rows of the files moved are updated
+        in only one transaction. If this transaction fails,
+        the files are moved back into their previous directory.
+
+        Args:
+            to_filedir (str): The new parent directory, relative
+                to the FSDIR.
+            batch_size (int): The number of files by batch.
+                Default set to BULK_BATCH_SIZE.
+            max_workers (int): The number of threads used to move
+                the files. Default set to BULK_MAX_WORKERS.
+
+        Returns:
+            tuple: The list of the primary keys of the moved files
+                and the dictionary of the failures
+                (primary key -> error message).
+        """
+        from .cache import invalidate
+        batch_size = batch_size or self.BULK_BATCH_SIZE
+        max_workers = max_workers or self.BULK_MAX_WORKERS
+        dirpaths = {}
+        moves = {}
+
+        def items(batch):
+            for instance in batch:
+                # the files stay on their storage tier
+                if instance.tier not in dirpaths:
+                    dirpaths[instance.tier] = self.model(
+                        filedir=to_filedir, tier=instance.tier or '').dirpath
+                    os.makedirs(dirpaths[instance.tier], exist_ok=True)
+                src = instance.filepath
+                dst = os.path.join(dirpaths[instance.tier],
+                                   os.path.basename(src))
+                moves[instance.pk] = (src, dst)
+            return [moves[instance.pk] for instance in batch]
+
+        done, failed = self._run(_rename, items, batch_size, max_workers)
+        try:
+            with transaction.atomic(using=self.db):
+                for i in range(0, len(done), batch_size):
+                    self.model._base_manager.using(self.db)\
+                        .filter(pk__in=done[i:i + batch_size])\
+                        .update(filedir=to_filedir)
+                transaction.on_commit(
+                    lambda: invalidate(self.model, *done), using=self.db)
+        except Exception:
+            printerr("Updating error, the files are moved back.")
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                list(pool.map(_rename,
+                              [moves[pk][::-1] for pk in done]))
+            raise
+
+        printsucc("{} files are moved to -> {}.".format(len(done), to_filedir))
+        if failed:
+            printerr("{} files are not moved.".format(len(failed)))
+        return done, failed
+
+
 class File(models.Model):
     """
     Model DB abstract of a file
@@ -52,6 +268,31 @@ class File(models.Model):
         blank=True,
         verbose_name=_("Extension")
     )
+    tier = models.CharField(
+        max_length=32,
+        null=True,
+        blank=True,
+        verbose_name=_("Storage tier")
+    )
+    hits = models.PositiveBigIntegerField(default=0,
+                                          verbose_name=_("Access count"))
+    accessed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Last access date")
+    )
+    mtime = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name=_("Modification time")
+    )
+    inode = models.PositiveBigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("Inode")
+    )
+
+    objects = FileQuerySet.as_manager()
 
     class Meta:
         unique_together = ('filedir', 'name', 'ext')
@@ -62,25 +303,75 @@ class File(models.Model):
     def dirpath(self):
         """ 
         Returns the full path to the parent folder
-        of this file.
+        of this file, in the root of its storage tier.
         """
+        if self.tier is None and self._state.adding:
+            # a new file is placed by the placement policy
+            from .tiering import placement
+            self.tier = placement(self)
+        root = tier_root(self.tier)
         if self.filedir or self.DEFAULT_DIR_NAME:
             if not self.filedir: self.filedir = self.DEFAULT_DIR_NAME
-            return os.path.join(FSDIR, self.filedir)
+            return os.path.join(root, self.filedir)
         else:
-            return FSDIR
+            return root
 
     @property
     def filepath(self):
-        """ Returns the full path to this file """
-        self._fix_filename()
-        return os.path.join(self.dirpath, self.name)
+        """
+        Returns the full path to this file, it is computed
+        again only if the fields of the path are changed.
+        """
+        key = (tier_root(self.tier), self.tier, self.filedir,
+               self.name, self.ext)
+        if key != self._path_key:
+            self._fix_filename()
+            self._filepath = os.path.join(self.dirpath, self.name)
+            self._path_key = (tier_root(self.tier), self.tier, self.filedir,
+                              self.name, self.ext)
+        return self._filepath
+
+    def stat(self, refresh=False):
+        """ Function to get the stat snapshot of this file.
+
+        The snapshot is taken once, then it is reused until
+        a refresh is asked or the path of the file is changed.
+
+        Args:
+            refresh (bool): Take a new snapshot.
+
+        Returns:
+            :obj:`os.stat_result`: The snapshot, or None
+                if this file is not exists.
+        """
+        filepath = self.filepath
+        if refresh or filepath != self._stat_path:
+            try:
+                self._stat = os.stat(filepath)
+            except OSError:
+                self._stat = None
+            self._stat_path = filepath
+        return self._stat
+
+    def has_changed(self):
+        """
+        Function to check if this file is changed on the file system
+        since its size, mtime and inode are saved.
+        """
+        st = self.stat(refresh=True)
+        if st is None:
+            return True
+        return (st.st_size, st.st_mtime, st.st_ino)\
+            != (self.size, self.mtime, self.inode)
 
     def url(self, host='/'):
-        """ Function to build a URL to this file """
+        """
+        Function to build a URL to this file, it is the same
+        on all the storage tiers.
+        """
         filedir = self.filedir or self.DEFAULT_DIR_NAME
         # fileext = self.ext     or self.DEFAULT_FILE_EXT;
-        fileurl = FSURL[1:]
+        fileurl = mfs_settings.FSURL[1:]
         if filedir:
             fileurl += f"{filedir}/"
         fileurl += self.name
@@ -91,6 +382,11 @@ class File(models.Model):
         """ Constructor of the file model """
         super(File, self).__init__(*args, **kwargs)
         self._instance = None
+        self._pending_tasks = []
+        self._path_key = None
+        self._filepath = None
+        self._stat = None
+        self._stat_path = None
 
         # correction of the file name passed in argument
         self._fix_filename()
@@ -111,7 +407,7 @@ class File(models.Model):
             if not self.ext: self.ext = self.DEFAULT_FILE_EXT
             self.name += '.{}'.format(self.ext)
         """
-        ext = self.DEFAULT_FILE_EXT.strip()
+        ext = (self.DEFAULT_FILE_EXT or '').strip()
         name = self.name.strip()
         namesplit = name.split('.')
         if len(namesplit) == 1 or (len(namesplit) == 2 and not namesplit[0]):
@@ -125,31 +421,59 @@ class File(models.Model):
     def mkdir(self):
         """ Function to create the fildir for this file """
         # we check if the uploading directory is exists
-        if os.path.isdir(FSDIR):
-            if not os.path.isdir(self.dirpath):
-                os.makedirs(self.dirpath)
+        dirpath = self.dirpath
+        if dirpath in _known_dirs:
+            return True
+        root = tier_root(self.tier)
+        if os.path.isdir(root):
+            try:
+                os.makedirs(dirpath)
                 printsucc("Directory at -> {} is created."\
-                    .format(self.dirpath))
+                    .format(dirpath))
+            except FileExistsError:
+                if not os.path.isdir(dirpath):
+                    printerr("{} is not a directory.".format(dirpath))
+                    return False
+            _known_dirs.add(dirpath)
             return True
-        printerr("The fs directory -> {} is not exists.".format(FSDIR))
+        printerr("The fs directory -> {} is not exists.".format(root))
         return False
 
     def touch(self):
-        """ Function to create this file in the dirpath. """
-        # create dir if not existe
-        created = self.mkdir()
-        if created:
+        """
+        Function to create this file in the dirpath. The stat
+        snapshot of this file is taken again.
+        """
+        if self.stat(refresh=True) is not None:
+            return self
+
+        # the dir can be removed since it is known,
+        # so it is created again once at most.
+        for retry in (False, True):
+            # create dir if not existe
+            if not self.mkdir():
+                return False
             # if the dir is created, then we can create this file.
-            if not os.path.isfile(self.filepath):
+            try:
                 f = open(self.filepath, 'x')
+            except FileExistsError:
+                break
+            except FileNotFoundError:
+                _known_dirs.discard(self.dirpath)
+                if retry:
+                    printerr("Creating error of the file at -> {}."
+                             .format(self.filepath))
+                    return False
+            else:
                 f.close()
                 printsucc("File at -> {} is created.".format(self.filepath))
-            return self
-        return False
+                break
+        self.stat(refresh=True)
+        return self
 
     def exists(self):
         """ Function to check if this file is exists. """
-        return os.path.exists(self.filepath)
+        return self.stat(refresh=True) is not None
 
     def open(self,  mode='rt'):
         """ Function to open a file """
@@ -216,9 +540,22 @@ class File(models.Model):
         in the database.
         """
         created = self.touch()
-        if created:
-            self.size = os.path.getsize(self.filepath)
-            return super(File, self).save(*args, **kwargs)
+        if created and self._stat is not None:
+            # the snapshot taken by touch() is reused
+            self.size = self._stat.st_size
+            self.mtime = self._stat.st_mtime
+            self.inode = self._stat.st_ino
+            saved = super(File, self).save(*args, **kwargs)
+            if self._pending_tasks:
+                # the post processing tasks of this file are
+                # queued to be run by the mfs_worker command,
+                # once the row of this file is committed.
+                from .tasks import enqueue
+                pending = self._pending_tasks
+                self._pending_tasks = []
+                transaction.on_commit(lambda: enqueue(self, *pending),
+                                      using=kwargs.get('using'))
+            return saved
 
         printerr("Unable to save this file at -> {} !".format(self.filepath))
         return False
@@ -226,10 +563,12 @@ class File(models.Model):
     def delete(self):
         """ Function to delete a file. """
         try:
-            if self.exists():
-                os.remove(self.filepath)
-                printsucc("File at -> {} is deleted.".format(self.filepath))
-                return True
+            os.remove(self.filepath)
+            self._stat = None
+            printsucc("File at -> {} is deleted.".format(self.filepath))
+            return True
+        except FileNotFoundError:
+            pass
         except:
             printerr("Deleting error of {} file.".format(self.filepath))
         printerr("File of {} is not exists.".format(self.filepath))
@@ -240,3 +579,93 @@ class File(models.Model):
         """
         return f"{self.filepath}"
 
+
+class Job(models.Model):
+    """
+    Model DB of a processing task of a file, queued to be run
+    in background by the mfs_worker command.
+    """
+    PENDING = 0x00
+    RUNNING = 0x01
+    DONE = 0x02
+    FAILED = 0x03
+
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed')
+    ]
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        editable=False,
+        verbose_name=_("Creation date")
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_("Updating date")
+    )
+    task = models.CharField(max_length=64, verbose_name=_("Task"))
+    model = models.CharField(max_length=255, verbose_name=_("File model"))
+    object_id = models.CharField(max_length=64, verbose_name=_("File id"))
+    status = models.PositiveIntegerField(
+        choices=STATUSES,
+        default=PENDING,
+        verbose_name=_("Status")
+    )
+    attempts = models.PositiveIntegerField(default=0,
+                                           verbose_name=_("Attempts"))
+    max_attempts = models.PositiveIntegerField(default=3,
+                                               verbose_name=_("Max attempts"))
+    run_after = models.DateTimeField(default=timezone.now,
+                                     verbose_name=_("Run after"))
+    claimed_at = models.DateTimeField(null=True, blank=True,
+                                      verbose_name=_("Claim date"))
+    result = models.JSONField(null=True, blank=True,
+                              verbose_name=_("Result"))
+    error = models.TextField(blank=True, default='', verbose_name=_("Error"))
+
+    class Meta:
+        ordering = ['run_after']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        """
+        Function to represent a job as a of a string of characters.
+        """
+        return f"{self.task} of {self.model}:{self.object_id}"
+
+
+class Revocation(models.Model):
+    """
+    Model DB of a revocation of the access tokens, by token id,
+    by user or by file. A revocation is kept until all the tokens
+    that it revokes are expired.
+    """
+    TOKEN = 'token'
+    USER = 'user'
+    FILE = 'file'
+
+    KINDS = [
+        (TOKEN, 'Token'),
+        (USER, 'User'),
+        (FILE, 'File')
+    ]
+
+    kind = models.CharField(max_length=8, choices=KINDS,
+                            verbose_name=_("Kind"))
+    value = models.CharField(max_length=255, verbose_name=_("Value"))
+    revoked_at = models.DateTimeField(default=timezone.now,
+                                      verbose_name=_("Revocation date"))
+    expires_at = models.DateTimeField(db_index=True,
+                                      verbose_name=_("Expiration date"))
+
+    class Meta:
+        ordering = ['revoked_at']
+
+    def __str__(self):
+        """
+        Function to represent a revocation as a of a string of characters.
+        """
+        return f"{self.kind}:{self.value}"
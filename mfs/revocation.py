@@ -0,0 +1,215 @@
+import math
+import time
+import hashlib
+import datetime as dt
+import threading
+from django.utils import timezone
+from .conf import mfs_settings
+from .models import Revocation
+
+
+class BloomFilter:
+    """
+    Bloom filter of strings, it answers "not in the set" without
+    false negatives, with a false positive rate of about error_rate
+    for capacity items.
+    """
+
+    def __init__(self, capacity=1024, error_rate=0.01):
+        """ Constructor of the Bloom filter """
+        capacity = max(1, capacity)
+        nbits = -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        self.nbits = max(8, int(math.ceil(nbits)))
+        self.nhashes = max(1, round(self.nbits / capacity * math.log(2)))
+        self.bits = bytearray((self.nbits + 7) // 8)
+
+    def _positions(self, item):
+        """ Function to compute the bit positions of an item. """
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.nbits for i in range(self.nhashes))
+
+    def add(self, item):
+        """ Function to add an item in the filter. """
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+
+class RevocationList:
+    """
+    In-process list of the revocations of the access tokens.
+
+    The checks cost O(1) without database access: a Bloom filter
+    rejects the keys that are not revoked, then an exact dictionary
+    confirms the others. The list is reloaded from the Revocation
+    table at most every MFS_REVOCATION_SYNC seconds, the expired
+    revocations are not loaded.
+    """
+
+    def __init__(self):
+        """ Constructor of the revocation list """
+        # the Bloom filter and the exact dictionary are swapped
+        # together, the checks never see a list being rebuilt.
+        self._state = (BloomFilter(), {})
+        self._synced_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(kind, value):
+        """ Function to build the key of a revocation. """
+        return f"{kind}:{value}"
+
+    @classmethod
+    def _add(cls, state, kind, value, revoked_at, expires_at):
+        """ Function to add a revocation in a Bloom filter and a dict. """
+        bloom, entries = state
+        key = cls.key(kind, value)
+        # the entry is set before the bits of the filter, so
+        # a key found in the filter is always in the dict.
+        entries[key] = (revoked_at.timestamp(), expires_at.timestamp())
+        bloom.add(key)
+
+    def sync(self, force=False):
+        """ Function to reload the revocations from the database.
+
+        Only one thread reloads the list, the other threads continue
+        to check the current list in the meantime. The new list is
+        built aside, then it replaces the current one at once. The
+        first sync is waited by all the threads, because the list
+        is empty before it.
+
+        Args:
+            force (bool): Reload even if the sync interval
+                is not elapsed.
+        """
+        def fresh():
+            return self._synced_at is not None and time.monotonic()\
+                - self._synced_at < mfs_settings.MFS_REVOCATION_SYNC
+
+        if not force and fresh():
+            return
+        if not self._lock.acquire(blocking=force or self._synced_at is None):
+            return
+        try:
+            if not force and fresh():
+                # synced by another thread in the meantime
+                return
+            started = time.monotonic()
+            rows = list(Revocation.objects
+                        .filter(expires_at__gt=timezone.now())
+                        .values_list('kind', 'value',
+                                     'revoked_at', 'expires_at'))
+            state = (BloomFilter(capacity=2 * len(rows) + 1024), {})
+            for row in rows:
+                self._add(state, *row)
+            self._state = state
+            self._synced_at = started
+        finally:
+            self._lock.release()
+
+    def is_revoked(self, data):
+        """ Function to check if an access token is revoked.
+
+        Args:
+            data (dict): The payload of the access token.
+
+        Returns:
+            bool: True if the token, its user or its file is revoked.
+        """
+        self.sync()
+        user = data.get('user')
+        username = user.get('username') if isinstance(user, dict) else None
+        bloom, entries = self._state
+        now = time.time()
+        for kind, value in ((Revocation.TOKEN, data.get('jti')),
+                            (Revocation.USER, username),
+                            (Revocation.FILE, data.get('file'))):
+            if value is None:
+                continue
+            key = self.key(kind, value)
+            if key not in bloom:
+                continue
+            entry = entries.get(key)
+            if entry is None or entry[1] <= now:
+                continue
+            # a revocation by user or by file revokes only
+            # the tokens issued before it.
+            if kind == Revocation.TOKEN or data.get('iat', 0) <= entry[0]:
+                return True
+        return False
+
+    def revoke(self, kind, value, expires_at):
+        """ Function to save a revocation.
+
+        Args:
+            kind (str): Revocation.TOKEN, Revocation.USER
+                or Revocation.FILE.
+            value (str): The token id, the user name or the file key.
+            expires_at (:obj:`datetime`): The date after which all
+                the revoked tokens are expired.
+
+        Returns:
+            :obj:`Revocation`: The saved revocation.
+        """
+        Revocation.objects.filter(expires_at__lte=timezone.now()).delete()
+        revocation = Revocation.objects.create(kind=kind, value=value,
+                                               expires_at=expires_at)
+        with self._lock:
+            # not added during a sync, which would replace the list
+            self._add(self._state, kind, value,
+                      revocation.revoked_at, expires_at)
+        return revocation
+
+
+def file_key(file, pk=None):
+    """ Function to build the key of a file used in the access tokens.
+
+    Args:
+        file: The file object, or the file model class.
+        pk: The primary key of the file. Default set to file.pk.
+    """
+    return f"{file._meta.label_lower}:{file.pk if pk is None else pk}"
+
+
+def _max_expiration():
+    """ Function to get the expiration date of the last valid token. """
+    return timezone.now() + dt.timedelta(
+        seconds=mfs_settings.MFS_ACCESS_TOKEN_MAX_AGE)
+
+
+def revoke_token(data):
+    """ Function to revoke an access token.
+
+    Args:
+        data (dict): The payload of the access token.
+    """
+    expires_at = dt.datetime.fromtimestamp(data['exp'], tz=dt.timezone.utc)
+    return revocations.revoke(Revocation.TOKEN, data['jti'], expires_at)
+
+
+def revoke_user(user):
+    """ Function to revoke all the access tokens issued to a user.
+
+    Args:
+        user: The user object, or its user name.
+    """
+    username = getattr(user, 'username', user)
+    return revocations.revoke(Revocation.USER, username, _max_expiration())
+
+
+def revoke_file(file):
+    """ Function to revoke all the access tokens issued for a file.
+
+    Args:
+        file (:obj:`File`): The file object.
+    """
+    return revocations.revoke(Revocation.FILE, file_key(file),
+                              _max_expiration())
+
+
+revocations = RevocationList()
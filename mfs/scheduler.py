@@ -0,0 +1,225 @@
+import time
+import threading
+from .conf import mfs_settings
+
+
+class TokenBucket:
+    """
+    Token bucket used to pace a stream of bytes at a rate
+    (bytes per second), with a burst capacity.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """ Constructor of the token bucket """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """ Function to add the tokens earned since the last refill. """
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def reserve(self, amount):
+        """ Function to take some tokens from the bucket.
+
+        The bucket can go in debt, the caller has to wait
+        the returned delay before sending its bytes.
+
+        Args:
+            amount (int): The number of tokens (bytes).
+
+        Returns:
+            float: The delay in seconds to wait.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class DownloadScheduler:
+    """
+    Scheduler of the downloads, it limits the number of concurrent
+    streams of each client and shares fairly the bandwidth
+    between the clients by pacing the chunks of the responses.
+
+    The scheduler state is kept in each process: the shared
+    bandwidth (total_rate) is divided by the number of server
+    processes (processes), so its sum over all the processes
+    respects the settings. The limits of a client are applied
+    as configured in each process.
+    """
+
+    def __init__(self, **config):
+        """ Constructor of the download scheduler
+
+        Args:
+            rate (int): The max bandwidth of a client, in bytes
+                per second. None for no limit.
+            total_rate (int): The bandwidth shared between all the
+                clients, in bytes per second. None for no limit.
+            max_streams (int): The max number of concurrent streams
+                of a client. None for no limit.
+            wait (float): The max time in seconds that a stream waits
+                for a free slot before being rejected.
+            processes (int): The number of server processes.
+
+            By default, they are the MFS_DOWNLOAD_RATE,
+            MFS_DOWNLOAD_TOTAL_RATE, MFS_DOWNLOAD_MAX_STREAMS,
+            MFS_DOWNLOAD_WAIT and MFS_DOWNLOAD_PROCESSES settings.
+        """
+        self._config = config
+        self._cond = threading.Condition()
+        self._streams = {}
+        self._buckets = {}
+
+    @property
+    def processes(self):
+        return max(1, self._config.get(
+            'processes', mfs_settings.MFS_DOWNLOAD_PROCESSES))
+
+    @property
+    def rate(self):
+        return self._config.get('rate', mfs_settings.MFS_DOWNLOAD_RATE)
+
+    @property
+    def total_rate(self):
+        rate = self._config.get('total_rate',
+                                mfs_settings.MFS_DOWNLOAD_TOTAL_RATE)
+        return rate / self.processes if rate else rate
+
+    @property
+    def max_streams(self):
+        return self._config.get('max_streams',
+                                mfs_settings.MFS_DOWNLOAD_MAX_STREAMS)
+
+    @property
+    def wait(self):
+        return self._config.get('wait', mfs_settings.MFS_DOWNLOAD_WAIT)
+
+    def share(self):
+        """ Function to compute the bandwidth of each active client. """
+        rates = [r for r in (self.rate, self.total_rate) if r]
+        if self.total_rate and self._streams:
+            rates.append(self.total_rate / len(self._streams))
+        return min(rates) if rates else None
+
+    def _rebalance(self):
+        """ Function to update the rate of the buckets of the clients. """
+        rate = self.share()
+        for bucket in self._buckets.values():
+            bucket.rate = bucket.capacity = rate
+
+    def acquire(self, key):
+        """ Function to take a stream slot of a client.
+
+        The caller waits while the client has already max_streams
+        streams running.
+
+        Args:
+            key (str): The client key.
+
+        Returns:
+            bool: True if a slot is taken, False on timeout.
+        """
+        with self._cond:
+            ok = self._cond.wait_for(
+                lambda: not self.max_streams
+                or self._streams.get(key, 0) < self.max_streams,
+                timeout=self.wait,
+            )
+            if not ok:
+                return False
+            self._streams[key] = self._streams.get(key, 0) + 1
+            if key not in self._buckets and self.share():
+                self._buckets[key] = TokenBucket(self.share())
+            self._rebalance()
+            return True
+
+    def release(self, key):
+        """ Function to give back a stream slot of a client. """
+        with self._cond:
+            count = self._streams.get(key, 0) - 1
+            if count > 0:
+                self._streams[key] = count
+            else:
+                self._streams.pop(key, None)
+                self._buckets.pop(key, None)
+            self._rebalance()
+            self._cond.notify_all()
+
+    def pace(self, key, chunks):
+        """ Function to pace the chunks of a stream of a client.
+
+        Args:
+            key (str): The client key, the slot must be acquired.
+            chunks (iterable): The chunks of the response.
+
+        Returns:
+            :obj:`PacedStream`: The paced iterator of the chunks.
+        """
+        return PacedStream(self, key, chunks)
+
+
+class PacedStream:
+    """
+    Iterator of the chunks of a response paced by the bucket of
+    the client. The stream slot of the client is released when the
+    stream is exhausted or closed, even if it is never iterated.
+    """
+
+    def __init__(self, scheduler, key, chunks):
+        """ Constructor of the paced stream """
+        self.scheduler = scheduler
+        self.key = key
+        self.chunks = iter(chunks)
+        self.released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.close()
+            raise
+        bucket = self.scheduler._buckets.get(self.key)
+        if bucket is not None:
+            delay = bucket.reserve(len(chunk))
+            if delay:
+                time.sleep(delay)
+        return chunk
+
+    def close(self):
+        """ Function to release the stream slot of the client. """
+        if not self.released:
+            self.released = True
+            self.scheduler.release(self.key)
+
+
+def client_key(data, request):
+    """ Function to get the key of a client of the downloads.
+
+    Args:
+        data (dict): The payload of the access token.
+        request (:obj:`HTTPRequest`): The HTTP request.
+
+    Returns:
+        str: The user name, or the IP address of the client.
+    """
+    user = data.get('user')
+    if isinstance(user, dict) and user.get('username'):
+        return f"user:{user['username']}"
+    ipc = data.get('ipc') or request.META.get('REMOTE_ADDR')
+    return f"ip:{ipc}"
+
+
+scheduler = DownloadScheduler()
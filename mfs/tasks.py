@@ -0,0 +1,176 @@
+import os
+import hashlib
+import mimetypes
+from django.apps import apps
+from .models import File
+from .models import Job
+
+
+CHUNK_SIZE = 64 * 1024
+
+# magic numbers of the common file formats,
+# checked on the first bytes of the files.
+MAGIC_NUMBERS = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'BM', 'image/bmp'),
+    (b'OggS', 'audio/ogg'),
+    (b'fLaC', 'audio/flac'),
+    (b'ID3', 'audio/mpeg'),
+    (b'\x1aE\xdf\xa3', 'video/webm'),
+]
+
+# more specific formats stored in the container formats,
+# they are recognized by the extensions of the files.
+CONTAINERS = {
+    'application/zip': {'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp',
+                        'odg', 'epub', 'jar', 'apk', 'xpi', 'kmz'},
+    'audio/ogg': {'ogv', 'ogx', 'opus', 'spx'},
+    'video/webm': {'weba'},
+}
+
+TASKS = {}
+
+
+def register(name, apply=None):
+    """ Decorator to register a processing task of the files.
+
+    The task function is run in a worker process, it receives
+    the path of the file and returns a JSON serializable result.
+    The apply function, if it is given, is run in the main process
+    of the worker with the file model, the file id and the result,
+    to update the database.
+
+    Args:
+        name (str): The name of the task.
+        apply (callable): The function to apply the result.
+    """
+    def decorator(func):
+        TASKS[name] = (func, apply)
+        return func
+    return decorator
+
+
+def enqueue(file: File, *tasks):
+    """ Function to queue some processing tasks of a file.
+
+    Args:
+        file (:obj:`File`): The saved file object.
+        tasks (str): The names of the tasks.
+
+    Returns:
+        list: The list of the created jobs.
+    """
+    for task in tasks:
+        if task not in TASKS:
+            raise ValueError(f"The task {task} is not registered.")
+    return Job.objects.bulk_create([
+        Job(task=task,
+            model=file._meta.label,
+            object_id=str(file.pk)) for task in tasks
+    ])
+
+
+def resolve_filepaths(jobs):
+    """ Function to find the current paths of the files of some jobs.
+
+    The paths are resolved when the jobs are claimed, because the
+    files can be moved (bulk_move, storage tiers) after the queuing.
+
+    Args:
+        jobs (list): The list of jobs.
+
+    Returns:
+        dict: The path of the file of each job (job pk -> path),
+            or None if the file is deleted.
+    """
+    ids = {}
+    for job in jobs:
+        ids.setdefault(job.model, set()).add(job.object_id)
+    files = {}
+    for label, pks in ids.items():
+        model = apps.get_model(label)
+        for pk, file in model._base_manager.in_bulk(list(pks)).items():
+            files[(label, str(pk))] = file
+    paths = {}
+    for job in jobs:
+        file = files.get((job.model, job.object_id))
+        paths[job.pk] = file.filepath if file is not None else None
+    return paths
+
+
+def apply_result(job: Job, result):
+    """ Function to apply the result of a job on the database.
+
+    Args:
+        job (:obj:`Job`): The job done.
+        result: The result returned by the task.
+    """
+    _, apply = TASKS[job.task]
+    if apply is not None:
+        apply(apps.get_model(job.model), job.object_id, result)
+
+
+def run(task, filepath):
+    """ Function to run a task, it is called in the worker processes.
+
+    Args:
+        task (str): The name of the task.
+        filepath (str): The absolute path to the file.
+
+    Returns:
+        The result of the task.
+    """
+    func, _ = TASKS[task]
+    return func(filepath)
+
+
+def _update_ext(model, pk, result):
+    """ Function to replace the extension of a file by the sniffed one. """
+    if result and result.get('ext'):
+        model._base_manager.filter(pk=pk).update(ext=result['ext'])
+        from .cache import invalidate
+        invalidate(model, pk)
+
+
+@register('hash')
+def sha256(filepath):
+    """ Function to compute the SHA-256 digest of a file. """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return {"sha256": digest.hexdigest()}
+
+
+@register('mime', apply=_update_ext)
+def sniff(filepath):
+    """ Function to find the content type of a file from its content.
+
+    The content type guessed from the file name is kept if the magic
+    numbers of the file give the same type, or a container of this
+    type (a docx file is a zip file). The type of the magic numbers
+    is used only if the name gives no type or an unrelated one.
+    """
+    with open(filepath, 'rb') as f:
+        head = f.read(16)
+    magic_type = None
+    for magic, ctype in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            magic_type = ctype
+            break
+    name_type, _ = mimetypes.guess_type(filepath)
+    ext = os.path.splitext(filepath)[1].lstrip('.')
+    if magic_type is None or name_type == magic_type \
+            or ext.lower() in CONTAINERS.get(magic_type, ()):
+        content_type = name_type or magic_type
+        if content_type is None:
+            return {"content_type": None, "ext": None}
+        return {"content_type": content_type, "ext": ext or None}
+    ext = mimetypes.guess_extension(magic_type) or ''
+    return {"content_type": magic_type, "ext": ext.lstrip('.') or None}
@@ -1,3 +1,481 @@
-from django.test import TestCase
+import os
+import time
+import shutil
+import tempfile
+import datetime as dt
+from concurrent.futures import Future
+from unittest import mock
+import jwt
+from django.conf import settings as django_settings
+from django.db import connection
+from django.db import models
+from django.db import transaction
+from django.http import Http404
+from django.test import RequestFactory
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.utils import timezone
+from . import cache
+from . import tiering
+from . import middlew
+from . import revocation
+from . import views
+from .models import File
+from .models import Job
+from .models import _rename
+from .models import Revocation
+from .revocation import BloomFilter
+from .revocation import RevocationList
+from .scheduler import DownloadScheduler
+from .tasks import sha256
+from .tasks import sniff
+from .views import serve
+from .management.commands.mfs_worker import Command as WorkerCommand
 
-# Create your tests here.
+
+class Document(File):
+    """
+    File model used by the tests.
+    """
+    DEFAULT_DIR_NAME = "Documents"
+    DEFAULT_FILE_EXT = "txt"
+
+    class Meta(File.Meta):
+        app_label = 'mfs'
+        # its table is created by the tests
+        managed = False
+
+
+class MfsTestCase(TransactionTestCase):
+    """
+    Test case with the table of the Document model and the
+    storage tiers in a temporary directory.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        with connection.schema_editor() as editor:
+            editor.create_model(Document)
+        cache.connect_signals()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            editor.delete_model(Document)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        settings = override_settings(
+            FSDIR=os.path.join(self.tmpdir, "fsdir"),
+            FSDIRS={"hot": os.path.join(self.tmpdir, "hot"),
+                    "cold": os.path.join(self.tmpdir, "cold")},
+            MFS_DEFAULT_TIER=None,
+            MFS_TIER_POLICY=None,
+            MFS_RESOLVE_CACHE=None,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for name in ("fsdir", "hot", "cold"):
+            os.makedirs(os.path.join(self.tmpdir, name))
+        cache.local.clear()
+        self.addCleanup(Document._base_manager.all().delete)
+        # the accesses are counted without the flushing thread
+        self.accesses = tiering.AccessCounter()
+        for patcher in (mock.patch.object(tiering.AccessCounter, '_start'),
+                        mock.patch.object(tiering, 'accesses', self.accesses),
+                        mock.patch.object(views, 'accesses', self.accesses)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create(self, name, content="data", **kwargs):
+        """ Function to create a saved document with its content. """
+        doc = Document(name=name, **kwargs)
+        doc.touch()
+        with open(doc.filepath, 'w') as f:
+            f.write(content)
+        doc.save()
+        return doc
+
+
+class BulkTests(MfsTestCase):
+
+    def test_bulk_delete_removes_rows_and_files(self):
+        docs = [self.create(f"d{i}") for i in range(3)]
+        done, failed = Document.objects.all().bulk_delete(batch_size=2)
+        self.assertEqual(sorted(done), sorted(d.pk for d in docs))
+        self.assertEqual(failed, {})
+        self.assertFalse(Document.objects.exists())
+        self.assertFalse(any(os.path.exists(d.filepath) for d in docs))
+
+    def test_bulk_delete_keeps_files_if_transaction_fails(self):
+        doc = self.create("kept")
+        with mock.patch.object(models.QuerySet, '_raw_delete',
+                               side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                Document.objects.all().bulk_delete()
+        self.assertTrue(Document.objects.filter(pk=doc.pk).exists())
+        self.assertTrue(os.path.exists(doc.filepath))
+
+    def test_bulk_delete_invalidates_once_on_commit(self):
+        docs = [self.create(f"k{i}") for i in range(3)]
+        with mock.patch.object(cache, 'invalidate') as invalidate:
+            with transaction.atomic():
+                Document.objects.all().bulk_delete(batch_size=2)
+                invalidate.assert_not_called()
+        invalidate.assert_called_once_with(Document, *[d.pk for d in docs])
+
+    def test_bulk_move_reports_existing_destination(self):
+        moved = self.create("a")
+        blocked = self.create("b", content="old")
+        dst = Document(name="b", filedir="Archives", tier=blocked.tier)
+        dst.touch()
+        with open(dst.filepath, 'w') as f:
+            f.write("concurrent")
+
+        done, failed = Document.objects.all().bulk_move("Archives")
+        self.assertEqual(done, [moved.pk])
+        self.assertIn(blocked.pk, failed)
+        with open(dst.filepath) as f:
+            self.assertEqual(f.read(), "concurrent")
+        blocked.refresh_from_db()
+        self.assertEqual(blocked.filedir, "Documents")
+        self.assertTrue(os.path.exists(blocked.filepath))
+
+    def test_bulk_move_moves_back_if_transaction_fails(self):
+        doc = self.create("c")
+        src = doc.filepath
+        with mock.patch.object(models.QuerySet, 'update',
+                               side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                Document.objects.all().bulk_move("Archives")
+        self.assertTrue(os.path.exists(src))
+        doc.refresh_from_db()
+        self.assertEqual(doc.filedir, "Documents")
+
+    def test_bulk_move_invalidates_on_commit(self):
+        doc = self.create("l")
+        with mock.patch.object(cache, 'invalidate') as invalidate:
+            with transaction.atomic():
+                Document.objects.all().bulk_move("Archives")
+                invalidate.assert_not_called()
+        invalidate.assert_called_once_with(Document, doc.pk)
+
+    def test_rename_reports_a_failed_rollback(self):
+        doc = self.create("m")
+        dst = os.path.join(self.tmpdir, "m.txt")
+        with mock.patch('os.unlink', side_effect=PermissionError("denied")):
+            error = _rename((doc.filepath, dst))
+        self.assertIn(dst, error)
+        self.assertTrue(os.path.exists(dst))
+
+
+class CacheTests(MfsTestCase):
+
+    def test_change_is_seen_after_commit(self):
+        doc = self.create("e")
+        self.assertEqual(cache.resolve(Document, doc.pk)["visibility"],
+                         File.PUBLIC)
+        doc.visibility = File.PRIVATE
+        doc.save()
+        self.assertEqual(cache.resolve(Document, doc.pk)["visibility"],
+                         File.PRIVATE)
+
+    def test_deleted_file_is_not_resolved(self):
+        doc = self.create("f")
+        cache.resolve(Document, doc.pk)
+        Document.objects.all().bulk_delete()
+        with self.assertRaises(Http404):
+            cache.resolve(Document, doc.pk)
+
+
+class TaskTests(MfsTestCase):
+
+    def write(self, name, content):
+        """ Function to write a file in the temporary directory. """
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_sha256(self):
+        path = self.write("a.txt", b"hello")
+        self.assertEqual(
+            sha256(path)["sha256"],
+            "2cf24dba5fb0a30e26e83b2ac5b9e29e"
+            "1b161e5c1fa7425e73043362938b9824")
+
+    def test_sniff_keeps_the_format_of_a_container(self):
+        path = self.write("report.docx", b"PK\x03\x04rest")
+        self.assertEqual(sniff(path), {
+            "content_type": "application/vnd.openxmlformats-"
+                            "officedocument.wordprocessingml.document",
+            "ext": "docx"})
+        path = self.write("app.apk", b"PK\x03\x04rest")
+        self.assertEqual(sniff(path)["ext"], "apk")
+
+    def test_sniff_keeps_the_extension_of_the_same_type(self):
+        path = self.write("photo.jpeg", b"\xff\xd8\xffrest")
+        self.assertEqual(sniff(path), {"content_type": "image/jpeg",
+                                       "ext": "jpeg"})
+
+    def test_sniff_prefers_the_content_to_an_unrelated_name(self):
+        path = self.write("image.txt", b"\x89PNG\r\n\x1a\nrest")
+        self.assertEqual(sniff(path), {"content_type": "image/png",
+                                       "ext": "png"})
+        path = self.write("archive", b"PK\x03\x04rest")
+        self.assertEqual(sniff(path), {"content_type": "application/zip",
+                                       "ext": "zip"})
+
+
+class MiddlewareTests(MfsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.scheduler = DownloadScheduler(max_streams=1, wait=0)
+        patcher = mock.patch.object(middlew, 'scheduler', self.scheduler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.revocations = RevocationList()
+        patcher = mock.patch.object(revocation, 'revocations',
+                                    self.revocations)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.middleware = middlew.FileAccessMiddleware(
+            lambda request: serve(request, request.path[len("/file/"):]))
+
+    def get(self, doc, file=None):
+        """ Function to download a document with an access token. """
+        now = int(time.time())
+        token = jwt.encode({'jti': 't1', 'user': {'username': 'alice'},
+                            'file': file or revocation.file_key(doc),
+                            'iat': now - 10, 'exp': now + 60},
+                           django_settings.SECRET_KEY, algorithm='HS256')
+        return self.middleware(RequestFactory().get(doc.url(), {'fid': token}))
+
+    def test_file_is_served_and_its_slot_released(self):
+        doc = self.create("n", content="hello")
+        with mock.patch.object(self.scheduler, 'pace',
+                               wraps=self.scheduler.pace) as pace:
+            response = self.get(doc)
+        self.assertEqual(response.status_code, 200)
+        pace.assert_called_once()
+        # the client has a single slot, taken by this stream
+        self.assertEqual(self.get(doc).status_code, 429)
+        self.assertEqual(b''.join(response.streaming_content), b"hello")
+        response.close()
+        self.assertEqual(self.get(doc).status_code, 200)
+
+    def test_token_of_another_file_is_rejected(self):
+        doc = self.create("o")
+        other = self.create("p")
+        self.assertEqual(self.get(doc, revocation.file_key(other))
+                         .status_code, 403)
+
+    def test_revoked_file_is_rejected(self):
+        doc = self.create("q")
+        self.revocations.revoke(Revocation.FILE, revocation.file_key(doc),
+                                timezone.now() + dt.timedelta(hours=1))
+        self.assertEqual(self.get(doc).status_code, 403)
+
+
+class SchedulerTests(MfsTestCase):
+
+    def test_slot_is_released_on_close(self):
+        scheduler = DownloadScheduler(max_streams=1, wait=0)
+        self.assertTrue(scheduler.acquire('a'))
+        self.assertFalse(scheduler.acquire('a'))
+        self.assertTrue(scheduler.acquire('b'))
+        # the stream is closed without being iterated
+        scheduler.pace('a', [b'data']).close()
+        self.assertTrue(scheduler.acquire('a'))
+
+    def test_only_the_shared_rate_is_divided_by_processes(self):
+        scheduler = DownloadScheduler(rate=1000, total_rate=4000,
+                                      max_streams=4, processes=4)
+        self.assertEqual(scheduler.rate, 1000)
+        self.assertEqual(scheduler.total_rate, 1000)
+        self.assertEqual(scheduler.max_streams, 4)
+
+
+class WorkerTests(MfsTestCase):
+
+    def failed_future(self):
+        """ Function to build a future of a failed task. """
+        future = Future()
+        future.set_exception(OSError("disk error"))
+        return future
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = Job.objects.create(task='hash', model='mfs.Document',
+                                 object_id='1', status=Job.RUNNING,
+                                 attempts=1, max_attempts=2)
+        WorkerCommand().finish(job, self.failed_future())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertGreater(job.run_after, timezone.now())
+
+        job.attempts = 2
+        WorkerCommand().finish(job, self.failed_future())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_expired_lease_is_claimed_again(self):
+        now = timezone.now()
+        dead = Job.objects.create(task='hash', model='mfs.Document',
+                                  object_id='1', status=Job.RUNNING,
+                                  attempts=1,
+                                  claimed_at=now - dt.timedelta(hours=1))
+        Job.objects.create(task='hash', model='mfs.Document',
+                           object_id='2', status=Job.RUNNING,
+                           attempts=1, claimed_at=now)
+        claimed = WorkerCommand().claim(10, lease=60)
+        self.assertEqual([job.pk for job in claimed], [dead.pk])
+
+    def test_expired_lease_of_the_last_attempt_fails(self):
+        job = Job.objects.create(task='hash', model='mfs.Document',
+                                 object_id='1', status=Job.RUNNING,
+                                 attempts=3, max_attempts=3,
+                                 claimed_at=timezone.now()
+                                 - dt.timedelta(hours=1))
+        self.assertEqual(WorkerCommand().claim(10, lease=60), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 3)
+
+    def test_job_paths_are_resolved_when_claimed(self):
+        from .tasks import resolve_filepaths
+        doc = self.create("g")
+        job = Job.objects.create(task='hash', model='mfs.Document',
+                                 object_id=str(doc.pk))
+        tiering.move(doc, "hot")
+        self.assertEqual(resolve_filepaths([job]), {job.pk: doc.filepath})
+
+
+class TieringTests(MfsTestCase):
+
+    def test_move_keeps_the_url(self):
+        doc = self.create("h", content="hello")
+        self.assertEqual(doc.tier, "cold")
+        url = doc.url()
+        path = url[len("/file/"):]
+        cache.resolve_path(path)
+        stale = cache.local.get(f"mfs:{Document._meta.label_lower}:{doc.pk}")
+
+        self.assertTrue(tiering.move(doc, "hot"))
+        self.assertEqual(doc.url(), url)
+        self.assertTrue(doc.filepath.startswith(os.path.join(self.tmpdir,
+                                                             "hot")))
+
+        # the cache of another worker still has the old path
+        cache.local.set(f"mfs:{Document._meta.label_lower}:{doc.pk}", stale)
+        response = serve(RequestFactory().get(url), path)
+        self.assertEqual(b''.join(response.streaming_content), b"hello")
+        response.close()
+
+    def test_serve_counts_the_served_file(self):
+        doc = self.create("r")
+        path = doc.url()[len("/file/"):]
+        serve(RequestFactory().get(doc.url()), path).close()
+        self.assertTrue(self.accesses.flush())
+        doc.refresh_from_db()
+        self.assertEqual(doc.hits, 1)
+        self.assertIsNotNone(doc.accessed_at)
+
+    def test_failed_flush_keeps_the_counts(self):
+        doc = self.create("s")
+        self.accesses.record(revocation.file_key(doc))
+        with mock.patch.object(models.QuerySet, 'update',
+                               side_effect=RuntimeError("db down")):
+            self.assertFalse(self.accesses.flush())
+        self.assertTrue(self.accesses.flush())
+        doc.refresh_from_db()
+        self.assertEqual(doc.hits, 1)
+
+    def test_rebalance_promotes_and_demotes(self):
+        hot = self.create("t", tier="hot")
+        cold = self.create("u")
+        Document._base_manager.filter(pk=cold.pk).update(hits=20)
+        for _ in range(3):
+            self.accesses.record(revocation.file_key(cold))
+        self.assertEqual(tiering.rebalance(Document, promote_hits=10,
+                                           demote_hits=1), (1, 1))
+        hot.refresh_from_db()
+        cold.refresh_from_db()
+        self.assertEqual((hot.tier, cold.tier), ("cold", "hot"))
+        self.assertEqual(cold.hits, 11)
+        self.assertTrue(os.path.exists(cold.filepath))
+
+
+class RevocationTests(MfsTestCase):
+
+    def token(self, iat, **kwargs):
+        """ Function to build the payload of an access token. """
+        data = {'jti': 't1', 'user': {'username': 'alice'},
+                'file': 'mfs.document:1', 'iat': iat,
+                'exp': int(time.time()) + 3600}
+        data.update(kwargs)
+        return data
+
+    def test_rebuild_never_exposes_a_partial_list(self):
+        revocations = RevocationList()
+        expires_at = timezone.now() + dt.timedelta(hours=1)
+        revocations.revoke(Revocation.TOKEN, 't2', expires_at)
+        revocations.sync(force=True)
+
+        data = self.token(int(time.time()), jti='t2')
+        seen = []
+        add = BloomFilter.add
+
+        def checking_add(bloom, item):
+            seen.append(revocations.is_revoked(data))
+            add(bloom, item)
+
+        with mock.patch.object(BloomFilter, 'add', checking_add):
+            revocations.sync(force=True)
+        self.assertTrue(seen)
+        self.assertTrue(all(seen))
+
+    def test_user_revocation_applies_to_older_tokens(self):
+        revocations = RevocationList()
+        expires_at = timezone.now() + dt.timedelta(hours=1)
+        revocation = revocations.revoke(Revocation.USER, 'alice', expires_at)
+        revoked_at = int(revocation.revoked_at.timestamp())
+        self.assertTrue(revocations.is_revoked(self.token(revoked_at - 10)))
+        self.assertFalse(revocations.is_revoked(self.token(revoked_at + 10)))
+
+    def test_expired_revocation_is_ignored(self):
+        revocations = RevocationList()
+        expires_at = timezone.now() - dt.timedelta(seconds=1)
+        revocations.revoke(Revocation.TOKEN, 't1', expires_at)
+        self.assertFalse(revocations.is_revoked(self.token(0)))
+
+
+class StatTests(MfsTestCase):
+
+    def test_mkdir_rejects_a_file_in_the_way(self):
+        doc = Document(name="i", filedir="Blocked")
+        with open(os.path.join(self.tmpdir, "cold", "Blocked"), 'w'):
+            pass
+        self.assertFalse(doc.mkdir())
+        self.assertFalse(doc.mkdir())
+
+    def test_save_takes_the_stat_snapshot(self):
+        doc = self.create("j", content="12345")
+        self.assertEqual(doc.size, 5)
+        self.assertFalse(doc.has_changed())
+        with open(doc.filepath, 'a') as f:
+            f.write("6")
+        self.assertTrue(doc.has_changed())
+
+    def test_touch_gives_up_on_a_missing_directory(self):
+        self.assertFalse(Document(name="sub/v").touch())
+
+    def test_touch_creates_a_removed_directory_again(self):
+        doc = self.create("w")
+        shutil.rmtree(doc.dirpath)
+        other = Document(name="x")
+        self.assertIs(other.touch(), other)
+        self.assertTrue(os.path.exists(other.filepath))
@@ -0,0 +1,222 @@
+import os
+import time
+import shutil
+import threading
+from collections import Counter
+from django.apps import apps
+from django.db import close_old_connections
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .conf import mfs_settings
+from .conf import tier_root
+from .utils import *
+
+
+def tiers():
+    """ Function to get the names of the storage tiers.
+
+    Returns:
+        list: The tiers of settings.FSDIRS, from the hottest
+            to the coldest.
+    """
+    return list(mfs_settings.FSDIRS)
+
+
+def default_placement(file):
+    """ Placement policy that puts the new files on the default tier.
+
+    Args:
+        file (:obj:`File`): The new file object.
+
+    Returns:
+        str: The settings.MFS_DEFAULT_TIER, or the coldest tier.
+    """
+    names = tiers()
+    return mfs_settings.MFS_DEFAULT_TIER or (names[-1] if names else '')
+
+
+def placement(file):
+    """ Function to choose the storage tier of a new file.
+
+    The placement policy is the function of dotted path
+    settings.MFS_TIER_POLICY, by default it is `default_placement`.
+    """
+    policy = mfs_settings.MFS_TIER_POLICY
+    return (import_string(policy) if policy else default_placement)(file)
+
+
+class AccessCounter:
+    """
+    In-process counter of the accesses of the files, it is
+    flushed in the database every MFS_TIER_FLUSH seconds by a
+    background thread, so the downloads never write in the database.
+    """
+
+    def __init__(self):
+        """ Constructor of the access counter """
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def record(self, key):
+        """ Function to count an access of a file.
+
+        Args:
+            key (str): The file key ("app_label.model:pk").
+        """
+        with self._lock:
+            self._counts[key] += 1
+            self._start()
+
+    def _start(self):
+        """ Function to start the flushing thread of this process. """
+        # a forked process has not the thread of its parent
+        if self._flusher is None or self._flusher[0] != os.getpid():
+            thread = threading.Thread(target=self._run, daemon=True,
+                                      name="mfs-accesses")
+            self._flusher = (os.getpid(), thread)
+            thread.start()
+
+    def _run(self):
+        """ Function of the flushing thread. """
+        while True:
+            time.sleep(mfs_settings.MFS_TIER_FLUSH)
+            self.flush()
+            close_old_connections()
+
+    def flush(self):
+        """ Function to write the counted accesses in the database.
+
+        The counts that are not written because of a database error
+        are given back to the counter, for the next flush.
+
+        Returns:
+            bool: True if all the counts are written.
+        """
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        if not counts:
+            return True
+
+        # the files are grouped by model and by count
+        # to update them with few statements.
+        groups = {}
+        for key, count in counts.items():
+            label, pk = key.rsplit(':', 1)
+            groups.setdefault((label, count), []).append(pk)
+        now = timezone.now()
+        failed = Counter()
+        for (label, count), pks in groups.items():
+            try:
+                model = apps.get_model(label)
+            except LookupError:
+                printerr(f"The accesses of the unknown model {label} "
+                         f"are ignored.")
+                continue
+            try:
+                model._base_manager.filter(pk__in=pks)\
+                    .update(hits=F('hits') + count, accessed_at=now)
+            except Exception as e:
+                printerr(f"The accesses of {label} are not saved: {e}")
+                failed.update({f"{label}:{pk}": count for pk in pks})
+        if failed:
+            with self._lock:
+                self._counts.update(failed)
+        return not failed
+
+
+accesses = AccessCounter()
+
+
+def move(file, tier):
+    """ Function to move a file on another storage tier.
+
+    The file is copied in a temporary file of the destination,
+    which is renamed atomically, then the row of the file is
+    updated. The source file is removed only after the update, so
+    the file is always readable at the path stored in the database.
+
+    Args:
+        file (:obj:`File`): The file object.
+        tier (str): The destination tier.
+
+    Returns:
+        bool: True if the file is moved.
+    """
+    src = file.filepath
+    dst = os.path.join(tier_root(tier),
+                       os.path.relpath(src, tier_root(file.tier)))
+    tmp = f"{dst}.mfs-tmp"
+    try:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dst)
+        inode = os.stat(dst).st_ino
+    except OSError as e:
+        printerr(f"Moving error of {src} to the {tier} tier: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+
+    with transaction.atomic():
+        updated = type(file)._base_manager\
+            .filter(pk=file.pk, tier=file.tier)\
+            .update(tier=tier, inode=inode)
+    if not updated:
+        # the file is changed in the meantime
+        os.remove(dst)
+        return False
+
+    from .cache import invalidate
+    invalidate(type(file), file.pk)
+    os.remove(src)
+    file.tier = tier
+    file.inode = inode
+    return True
+
+
+def rebalance(model, promote_hits=None, demote_hits=None, limit=None):
+    """ Function to promote and to demote the files of a model.
+
+    The files accessed at least promote_hits times are moved on the
+    hottest tier, the files of the hottest tier accessed less than
+    demote_hits times are moved on the default tier. Then the access
+    counts are halved, so the old accesses weigh less and less.
+
+    Args:
+        model (:obj:`type`): The file model class.
+        promote_hits (int): Default set to MFS_TIER_PROMOTE_HITS.
+        demote_hits (int): Default set to MFS_TIER_DEMOTE_HITS.
+        limit (int): The max number of files moved in each direction.
+
+    Returns:
+        tuple: The numbers of promoted and demoted files.
+    """
+    names = tiers()
+    if len(names) < 2:
+        return 0, 0
+    hot = names[0]
+    cold = default_placement(None)
+    if cold == hot:
+        cold = names[-1]
+    if promote_hits is None:
+        promote_hits = mfs_settings.MFS_TIER_PROMOTE_HITS
+    if demote_hits is None:
+        demote_hits = mfs_settings.MFS_TIER_DEMOTE_HITS
+
+    accesses.flush()
+    manager = model._base_manager
+    promoting = manager.exclude(tier=hot).filter(hits__gte=promote_hits)\
+        .order_by('-hits')
+    demoting = manager.filter(tier=hot, hits__lt=demote_hits)\
+        .order_by('hits')
+    promoted = sum(move(f, hot) for f in list(promoting[:limit]))
+    demoted = sum(move(f, cold) for f in list(demoting[:limit]))
+    manager.filter(hits__gt=0).update(hits=F('hits') / 2)
+    return promoted, demoted
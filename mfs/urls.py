@@ -3,9 +3,6 @@
 from django import urls
 from rest_framework import routers
 from . import views
-from . import FSDIR
-from . import FSURL
-from .utils import *
 
 
 router = routers.DefaultRouter()
@@ -16,8 +13,5 @@ urlpatterns = [
     urls.path('api/', urls.include(router.urls), name="api"),
 ]
 
-printinfo(f"FSDIR = {FSDIR}")
-printinfo(f"FSURL = {FSURL}")
-
 # define an URL for file directory.
 # urlpatterns += static(FSURL, document_root=FSDIR);
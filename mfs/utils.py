@@ -1,4 +1,6 @@
+import os
 import socket
+import random
 
 
 # Python program to print
@@ -99,6 +101,11 @@ def handle_uploaded_file(f, absfilepath):
             for chunk in f.chunks():
                 filedest.write(chunk);
 
+            # les données sont rendues durables avant de répondre,
+            # le reste du traitement est fait en arrière-plan.
+            filedest.flush();
+            os.fsync(filedest.fileno());
+
             """
             En bouclant sur UploadedFile.chunks() au lieu d’appeler read(),
             on peut s’assurer que les gros fichiers ne saturent 
@@ -1,18 +1,19 @@
 import os
 from django.db import models
 from django.shortcuts import render
-from django.shortcuts import get_object_or_404
 from rest_framework import response
 from rest_framework import views
 from rest_framework import generics
 from rest_framework import viewsets
-from . import FSDIR
-from . import FSURL
 from .serializers import FileUploadedSerializer
 from .utils import printinfo as info
 from .utils import printerr as erro
 from .utils import handle_uploaded_file
 from .models import File
+from .cache import resolve
+from .cache import lookup
+from .revocation import file_key
+from .tiering import accesses
 
 
 class FileUploadingAPI(viewsets.ViewSet):
@@ -50,6 +51,30 @@ class FileUploadingAPI(viewsets.ViewSet):
         return response.Response("OK")
 
 
+def serve(request, path):
+    """
+    View to serve a file from the root of its current storage tier.
+    The URL of a file does not change when it is moved between
+    the tiers, so the URLs already given stay valid. The accesses
+    of the served files are counted for the tiering.
+    """
+    from django.http import Http404
+    from django.views import static
+    model, pk, info = lookup(path)
+    try:
+        response = static.serve(
+            request, os.path.basename(info["filepath"]),
+            document_root=os.path.dirname(info["filepath"]))
+    except Http404:
+        # the cached path can be stale after a move of the file
+        model, pk, info = lookup(path, refresh=True)
+        response = static.serve(
+            request, os.path.basename(info["filepath"]),
+            document_root=os.path.dirname(info["filepath"]))
+    accesses.record(file_key(model, pk))
+    return response
+
+
 class Download(views.APIView):
     class Meta:
         model = None
@@ -57,15 +82,14 @@ class Download(views.APIView):
     def get(self, request, id):
         message = ""
         code = 200
-        assert isinstance(self.Meta.model, models.Model), (
+        assert issubclass(self.Meta.model, models.Model), (
             "The [Meta.model] value must be a django model."
         )
-        fileinstance = get_object_or_404(self.Meta.model, pk=id)
-        if fileinstance.visibility == File.PUBLIC:
-            url = fileinstance.url
+        fileinfo = resolve(self.Meta.model, id)
+        if fileinfo["visibility"] == File.PUBLIC:
+            url = request.build_absolute_uri(fileinfo["url"])
             return response.Response({"download": url}, status=code)
 
         message = "Access denied !"
         code = 403
         return response.Response({"message": message}, status=code)
-